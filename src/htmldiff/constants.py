@@ -8,38 +8,68 @@ WS_RE = re.compile(r'^([ \n\r\t]|&nbsp;)+$')
 WORD_RE = re.compile(
     r'([^ \n\r\t,.&;/#=<>()-]+|(?:[ \n\r\t]|&nbsp;)+|[,.&;/#=<>()-])'
 )
+# Tags and words in a single pass, matching the same tokens as splitting
+# on TAG_RE and then WORD_RE
+TOKEN_RE = re.compile(
+    r'<script.*?>.*?</script>|<.*?>|'
+    r'[^ \n\r\t,.&;/#=<>()-]+|(?:[ \n\r\t]|&nbsp;)+|[,.&;/#=<>()-]',
+    re.S
+)
+TAG_NAME_RE = re.compile(r'<\s*(/?)\s*([a-zA-Z][a-zA-Z0-9]*)')
+CHANGE_RE = re.compile(r'<(?:span|a) class="(?:insert|delete|move)"')
+MOVE_FROM_RE = re.compile(
+    r'<a class="move" id="move-(\d+)-from" href="#move-\d+">\[moved\]</a>'
+)
+MOVE_ANCHOR_RE = re.compile(r'<a id="move-\d+(-end)?"></a>')
+MOVE_TARGET_RE = re.compile(r'<a id="move-(\d+)"></a>')
+MOVE_SPAN_RE = re.compile(
+    r'<a id="move-(\d+)"></a>.*?<a id="move-\1-end"></a>', re.S
+)
+INSERT_SPAN_RE = re.compile(r'<span class="insert">.*?</span>', re.S)
+MOVED_SPAN_RE = re.compile(r'<span class="(?:delete|move)">(.*?)</span>', re.S)
 
 
-STOPWORDS = (
-    'a',
-    'about',
-    'an',
-    'and',
-    'are',
-    'as',
-    'at',
-    'be',
-    'by',
-    'for',
-    'from',
-    'have',
-    'how',
-    'I',
-    'in',
-    'is',
-    'it',
-    'of',
-    'on',
-    'or',
-    'that',
-    'the',
-    'this',
-    'to',
-    'was',
-    'what',
-    'when',
-    'where',
-    'who',
-    'will',
-    'with',
+BLOCK_TAGS = (
+    'address',
+    'article',
+    'aside',
+    'blockquote',
+    'dd',
+    'div',
+    'dl',
+    'dt',
+    'figure',
+    'footer',
+    'form',
+    'h1',
+    'h2',
+    'h3',
+    'h4',
+    'h5',
+    'h6',
+    'header',
+    'li',
+    'nav',
+    'ol',
+    'p',
+    'pre',
+    'section',
+    'table',
+    'tbody',
+    'tfoot',
+    'thead',
+    'tr',
+    'ul',
 )
+
+# Block level tags whose end tag may be left out, along with the start tags
+# that close them implicitly
+IMPLIED_END_TAGS = {
+    'dd': ('dd', 'dt'),
+    'dt': ('dd', 'dt'),
+    'li': ('li',),
+    'p': BLOCK_TAGS,
+    'tbody': ('tbody', 'tfoot'),
+    'thead': ('tbody', 'tfoot'),
+    'tr': ('tbody', 'tfoot', 'thead', 'tr'),
+}
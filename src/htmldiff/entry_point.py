@@ -4,6 +4,7 @@ Entry Point
 Command-line entry point
 """
 # Standard
+import io
 import os
 import argparse
 import logging
@@ -11,9 +12,17 @@ import sys
 import pkg_resources
 from os.path import abspath
 
+# Six
+import six
+
 # Project
-from htmldiff.lib import diff_files, gen_side_by_side
+from htmldiff.lib import (
+    HTMLMatcher, diff_files, diff_summary, gen_paged, gen_side_by_side,
+    read_html, read_source
+)
 from htmldiff.logger import logging_init
+from htmldiff.snapshot import write_snapshot
+from htmldiff.watch import DiffWatcher
 
 # Setup the version string
 try:
@@ -28,6 +37,22 @@ except Exception:
 LOG = logging.getLogger(__name__)
 
 
+def format_summary(summary):
+    """Render a diff summary as plain text, one field per line."""
+    lines = ['changed: {0}'.format('yes' if summary['changed'] else 'no')]
+    if summary['ratio'] is None:
+        lines.append('ratio: below {0:0.4f}'.format(summary['ratio_bound']))
+    else:
+        lines.append('ratio: {0:0.4f}'.format(summary['ratio']))
+    for key in ('inserted_words', 'deleted_words',
+                'inserted_tags', 'deleted_tags'):
+        value = summary[key]
+        lines.append('{0}: {1}'.format(
+            key.replace('_', ' '), 'unknown' if value is None else value
+        ))
+    return six.text_type('\n'.join(lines) + '\n')
+
+
 def diff():
     parser = argparse.ArgumentParser(
         description='Tool for diffing html & xhtml files',
@@ -50,6 +75,15 @@ def diff():
         default=False,
         action='store_true'
     )
+    parser.add_argument(
+        '-P',
+        '--popularity',
+        help='fraction of a document above which a token is too common to '
+             'start a match in risky mode',
+        dest='popularity',
+        default=None,
+        type=float
+    )
     parser.add_argument(
         '-s',
         '--side-by-side',
@@ -58,6 +92,47 @@ def diff():
         default=False,
         action='store_true'
     )
+    parser.add_argument(
+        '-S',
+        '--summary',
+        help='print a summary of the changes instead of rendering a diff',
+        dest='summary',
+        default=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '-c',
+        '--cutoff',
+        help='with --summary, stop early once the similarity ratio is known '
+             'to be below this value',
+        dest='cutoff',
+        default=None,
+        type=float
+    )
+    parser.add_argument(
+        '-w',
+        '--watch',
+        help='re-diff into the output file whenever an input file changes',
+        dest='watch',
+        default=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '-p',
+        '--paged',
+        help='split the diff into pages next to the output file, which '
+             'becomes an index of the pages',
+        dest='paged',
+        default=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--page-size',
+        help='number of characters after which to start a new page',
+        dest='page_size',
+        default=50000,
+        type=int
+    )
     parser.add_argument(
         '-V',
         '--version',
@@ -87,8 +162,13 @@ def diff():
     input_file2 = abspath(parsed_args.INPUT_FILE2)
     output_file = abspath(parsed_args.out_fn) if parsed_args.out_fn else None
     accurate_mode = parsed_args.accurate_mode
+    popularity = parsed_args.popularity
     sbs = parsed_args.side_by_side
-    if sbs:
+    if parsed_args.summary:
+        LOG.info('Selected change summary')
+    elif parsed_args.paged:
+        LOG.info('Selected paged inline diff')
+    elif sbs:
         LOG.info('Selected side-by-side diff')
     else:
         LOG.info('Selected inline diff')
@@ -101,6 +181,19 @@ def diff():
         LOG.error('Could not find: {0}'.format(input_file2))
         sys.exit(1)
 
+    if parsed_args.watch and (output_file is None or parsed_args.summary):
+        LOG.error('Watch mode requires an output file and an html diff')
+        sys.exit(1)
+
+    if parsed_args.paged and (output_file is None or parsed_args.summary or
+                              parsed_args.watch or sbs):
+        LOG.error('Paged mode requires an output file and an inline diff')
+        sys.exit(1)
+
+    if parsed_args.cutoff is not None and not parsed_args.summary:
+        LOG.error('A cutoff can only be used with a change summary')
+        sys.exit(1)
+
     LOG.debug('File 1: {0}'.format(input_file1))
     LOG.debug('File 2: {0}'.format(input_file2))
 
@@ -109,20 +202,59 @@ def diff():
     else:
         LOG.debug("Using 'Risky' mode")
 
-    LOG.info('Diffing files...')
-    try:
-        diffed_html = diff_files(input_file1, input_file2, accurate_mode)
-        if sbs:
-            diffed_html = gen_side_by_side(diffed_html)
-    except Exception:
-        LOG.exception('Diff process exited with an error')
-        sys.exit(1)
+    if parsed_args.watch:
+        DiffWatcher(
+            input_file1, input_file2, output_file, accurate_mode, sbs,
+            popularity=popularity
+        ).run()
+
+    if parsed_args.summary:
+        LOG.info('Summarizing changes...')
+        try:
+            diffed_html = format_summary(diff_summary(
+                read_source(input_file1), read_source(input_file2),
+                accurate_mode, cutoff=parsed_args.cutoff,
+                popularity=popularity
+            ))
+        except Exception:
+            LOG.exception('Summary process exited with an error')
+            sys.exit(1)
+    else:
+        LOG.info('Diffing files...')
+        try:
+            diffed_html = diff_files(
+                input_file1, input_file2, accurate_mode, popularity
+            )
+            if sbs:
+                diffed_html = gen_side_by_side(diffed_html)
+        except Exception:
+            LOG.exception('Diff process exited with an error')
+            sys.exit(1)
+
+    if parsed_args.paged:
+        output_dir, output_name = os.path.split(output_file)
+        page_name = os.path.splitext(output_name)[0] + '-{0:04d}.html'
+        try:
+            diffed_html, pages = gen_paged(
+                diffed_html, page_name, parsed_args.page_size
+            )
+            for number, page in enumerate(pages, 1):
+                page_file = os.path.join(output_dir, page_name.format(number))
+                with io.open(page_file, 'w', encoding='utf-8') as f:
+                    f.write(page)
+        except Exception:
+            LOG.exception('Unable to write diff pages to {0}'.format(
+                output_dir
+            ))
+            sys.exit(1)
+        else:
+            LOG.info('Wrote {0} pages to {1}'.format(len(pages), output_dir))
 
     if output_file is None:
         sys.stdout.write(diffed_html)
     else:
         try:
-            with open(output_file, 'w') as f:
+            with io.open(output_file, 'w', encoding='utf-8') as f:
                 f.seek(0)
                 f.truncate()
                 f.write(diffed_html)
@@ -134,11 +266,63 @@ def diff():
             sys.exit(0)
 
 
+def tokenize():
+    parser = argparse.ArgumentParser(
+        prog='htmldiff tokenize',
+        description='Store the tokens of an html file in a snapshot file '
+                    'which can be diffed in place of the html file',
+    )
+    parser.add_argument('INPUT_FILE')
+    parser.add_argument(
+        '-o',
+        '--output_file',
+        action='store',
+        dest='out_fn',
+        default=None,
+        help='[OPTIONAL] Snapshot file to write instead of INPUT_FILE.snapshot'
+    )
+    parser.add_argument(
+        '-l',
+        '--log-level',
+        default='INFO',
+        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'),
+        help='Logging level for Montana Scripts.'
+    )
+    parser.add_argument(
+        '-L',
+        '--logfile',
+        dest='logfile',
+        default=None,
+        help='Location to place a log of the process output'
+    )
+    parsed_args = parser.parse_args(sys.argv[2:])
+
+    logging_init(parsed_args.log_level, logfile=parsed_args.logfile)
+    input_file = abspath(parsed_args.INPUT_FILE)
+    output_file = abspath(parsed_args.out_fn or input_file + '.snapshot')
+
+    if not os.path.exists(input_file):
+        LOG.error('Could not find: {0}'.format(input_file))
+        sys.exit(1)
+
+    LOG.info('Tokenizing file...')
+    try:
+        tokens = HTMLMatcher('', '', True).split_html(read_html(input_file))
+        write_snapshot(tokens, output_file)
+    except Exception:
+        LOG.exception('Unable to write snapshot to {0}'.format(output_file))
+        sys.exit(1)
+    LOG.info('Wrote snapshot to {0}'.format(output_file))
+
+
 def main():
     import time
     t = time.time()
     try:
-        diff()
+        if sys.argv[1:2] == ['tokenize']:
+            tokenize()
+        else:
+            diff()
     except KeyboardInterrupt:
         # Write a nice message to stderr
         sys.stderr.write(
@@ -11,18 +11,31 @@ if (sys.version_info < (3, 0)):
 else:
     from html.parser import HTMLParser
 
+import io
 import logging
+from array import array
+from collections import Counter, defaultdict
 from copy import copy
-from difflib import SequenceMatcher
+from difflib import Match, SequenceMatcher
+from functools import partial
+from itertools import count
+try:
+    from itertools import accumulate
+except ImportError:
+    def accumulate(iterable):
+        total = 0
+        for value in iterable:
+            total += value
+            yield total
 
 # Six
 import six
 
-# Boltons
-from boltons.ioutils import SpooledBytesIO
-
 # Project
 from htmldiff.font_lookup import get_spacing
+from htmldiff.snapshot import (
+    KIND_TAG, KIND_TEXT, Snapshot, is_snapshot, read_snapshot, token_kind
+)
 from htmldiff import constants
 
 LOG = logging.getLogger(__name__)
@@ -48,6 +61,16 @@ def utf8_decode(val):
         raise TypeError('{} is not a unicode or str object'.format(val))
 
 
+def as_source(val):
+    """
+    Return a list of tokens or a snapshot as is, otherwise the given string
+    decoded.
+    """
+    if isinstance(val, (list, Snapshot)):
+        return val
+    return utf8_decode(val)
+
+
 def strip_tags(html_string):
     """
     Remove all HTML tags from a given string of html
@@ -87,22 +110,11 @@ def split_html(html_string):
     return start, body, ending
 
 
-def is_junk(x):
-    """
-    Used for the faster but less accurate mode.
-
-    :type x: string
-    :param x: string to match against
-    :returns: regex matched or lowercased x
-    """
-    return constants.WS_RE.match(utf8_decode(x)) or x.lower() in constants.STOPWORDS
-
-
 class TagIter(object):
     """Iterable that returns tags in sequence."""
 
     def __init__(self, html_string):
-        self.html_string = html_string
+        self.html_string = utf8_decode(html_string)
         self.pos = 0
         self.end_reached = False
         self.buffer = []
@@ -117,7 +129,7 @@ class TagIter(object):
         if self.end_reached:
             raise StopIteration
 
-        match = constants.TAG_RE.search(utf8_decode(self.html_string), pos=self.pos)
+        match = constants.TAG_RE.search(self.html_string, pos=self.pos)
         if not match:
             self.end_reached = True
             return self.html_string[self.pos:]
@@ -131,6 +143,39 @@ class TagIter(object):
         return self.__next__()
 
 
+class TokenSequence(object):
+    """
+    Tokens of an html document held as start and end offsets into its
+    source, along with an interned id for every token. Indexing returns the
+    token text, and a run of consecutive tokens can be taken from the source
+    as a single slice.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.starts = array('L')
+        self.ends = array('L')
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        source = self.source
+        if isinstance(index, slice):
+            return [
+                source[start:end] for start, end
+                in zip(self.starts[index], self.ends[index])
+            ]
+        return source[self.starts[index]:self.ends[index]]
+
+    def text(self, i1, i2):
+        """Return the source text of the tokens from i1 up to i2."""
+        if i1 >= i2:
+            return ''
+        return self.source[self.starts[i1]:self.ends[i2 - 1]]
+
+
 class TagStrip(HTMLParser):
     """
     Subclass of HTMLParser used to strip html tags from strings
@@ -153,6 +198,20 @@ class HTMLMatcher(SequenceMatcher):
     start_insert_text = '<span class="insert">'
     end_span_text = '</span>'
     start_delete_text = '<span class="delete">'
+    start_move_text = '<span class="move">'
+    move_from_text = (
+        '<a class="move" id="move-{0}-from" href="#move-{0}">[moved]</a>'
+    )
+    move_start_anchor = '<a id="move-{0}"></a>'
+    move_end_anchor = '<a id="move-{0}-end"></a>'
+    min_move_words = 4
+    move_ratio = 0.8
+    move_shingle = 3
+    move_candidates = 5
+    move_min_shared = 0.5
+    move_bucket_size = 50
+    popularity = 0.01
+    popular_min_tokens = 200
     stylesheet = (
             '.insert {\n\tbackground-color: #AFA\n}\n'
             '.delete {\n'
@@ -161,58 +220,395 @@ class HTMLMatcher(SequenceMatcher):
             '}\n'
             '.tagInsert {\n\tbackground-color: #070;\n\tcolor: #FFF\n}\n'
             '.tagDelete {\n\tbackground-color: #700;\n\tcolor: #FFF\n}\n'
+            '.move {\n\tbackground-color: #AAF\n}\n'
         )
 
-    def __init__(self, source1, source2, accurate_mode):
+    def __init__(self, source1, source2, accurate_mode, popularity=None):
         LOG.debug('Initializing HTMLMatcher...')
+        self.accurate_mode = accurate_mode
+        if popularity is not None:
+            self.popularity = popularity
         if accurate_mode:
             LOG.debug('Using accurate mode')
-            SequenceMatcher.__init__(self, lambda x: False, source1, source2, False)
         else:
             LOG.debug('Using fast mode')
-            SequenceMatcher.__init__(self, is_junk, source1, source2, False)
+        self.vocab = defaultdict(partial(next, count()))
+        self.kinds = bytearray()
+        self.ta = self.tb = None
+        SequenceMatcher.__init__(self, None, source1, source2, False)
+
+    def set_seq1(self, a):
+        self.ta = self.tokenize(a)
+        SequenceMatcher.set_seq1(self, self.ta.ids)
+
+    def set_seq2(self, b):
+        self.tb = self.tokenize(b)
+        SequenceMatcher.set_seq2(self, self.tb.ids)
+        if not self.accurate_mode:
+            self.drop_popular()
+
+    def tokenize(self, t):
+        """
+        Return the tokens of an html string as a TokenSequence. Equal tokens
+        share an id across both sequences of the matcher, so matching
+        compares ids rather than strings. The token strings themselves are
+        only kept as offsets into the source.
 
-    def set_seqs(self, a, b):
-        SequenceMatcher.set_seqs(self, self.split_html(a), self.split_html(b))
+        :param t: string of html, list of tokens, Snapshot or TokenSequence
+        :returns: TokenSequence
+        """
+        if isinstance(t, TokenSequence):
+            return t
+        if isinstance(t, Snapshot):
+            return self.tokenize_snapshot(t)
+        if isinstance(t, list):
+            items = t
+            tokens = TokenSequence(''.join(items))
+        else:
+            tokens = TokenSequence(utf8_decode(t))
+            items = self.split_html(tokens.source)
+
+        # Tokens cover the source without gaps, so each one starts where
+        # the previous one ended.
+        tokens.ends.extend(accumulate(map(len, items)))
+        if items:
+            tokens.starts.append(0)
+            tokens.starts.extend(tokens.ends[:-1])
+        tokens.ids = list(map(self.vocab.__getitem__, items))
+        self.add_kinds()
+        return tokens
+
+    def tokenize_snapshot(self, snapshot):
+        """
+        Return the tokens of a snapshot as a TokenSequence. Each entry of
+        the snapshot's vocabulary is given a matcher id once, along with its
+        stored kind, and the snapshot's ids are then mapped to those.
+
+        :type snapshot: Snapshot
+        :param snapshot: snapshot of a document
+        :returns: TokenSequence
+        """
+        vocab = self.vocab
+        kinds = self.kinds
+        known = len(kinds)
+        remap = []
+        for token, kind in zip(snapshot.vocab, snapshot.kinds):
+            token_id = vocab[token]
+            if token_id == len(kinds):
+                kinds.append(kind)
+            remap.append(token_id)
+        lengths = [len(token) for token in snapshot.vocab]
+
+        tokens = TokenSequence(
+            ''.join(map(snapshot.vocab.__getitem__, snapshot.ids))
+        )
+        tokens.ends.extend(accumulate(map(lengths.__getitem__, snapshot.ids)))
+        if tokens.ends:
+            tokens.starts.append(0)
+            tokens.starts.extend(tokens.ends[:-1])
+        if known:
+            tokens.ids = list(map(remap.__getitem__, snapshot.ids))
+        else:
+            # Ids are handed out in order, so into an empty vocabulary the
+            # snapshot's own ids carry over as they are
+            tokens.ids = list(snapshot.ids)
+        return tokens
+
+    def add_kinds(self):
+        """Record the kind of every token new to the vocabulary."""
+        known = len(self.kinds)
+        if len(self.vocab) == known:
+            return
+        new = bytearray(len(self.vocab) - known)
+        for token, token_id in self.vocab.items():
+            if token_id >= known:
+                new[token_id - known] = token_kind(token)
+        self.kinds.extend(new)
+
+    def compact_vocab(self, slack=2):
+        """
+        Rebuild the token vocabulary from the two current sequences once it
+        holds more than slack times as many tokens as they still use. Only
+        needed when sequences are replaced repeatedly, as in watch mode,
+        where every edit would otherwise leave its old tokens behind.
+
+        :type slack: integer
+        :param slack: factor by which the vocabulary may outgrow its use
+        :returns: True if the vocabulary was rebuilt
+        """
+        live = len(set(self.a).union(self.b))
+        if len(self.vocab) <= slack * live:
+            return False
+        LOG.debug('Compacting vocabulary of %s tokens', len(self.vocab))
+        self.vocab = defaultdict(partial(next, count()))
+        self.kinds = bytearray()
+        for tokens in (self.ta, self.tb):
+            tokens.ids = list(map(self.vocab.__getitem__, tokens[:]))
+        self.add_kinds()
+        self.set_seq1(self.ta)
+        self.set_seq2(self.tb)
+        return True
+
+    def drop_popular(self):
+        """
+        Remove popular tokens from the index of the second sequence for the
+        fast mode. Any token making up more than the popularity fraction of
+        a sequence of at least popular_min_tokens tokens is popular, which in
+        tag heavy documents catches the repeated tags that otherwise
+        dominate matching. Matches can not start on a popular token but are
+        still extended across them.
+        """
+        # With automatic junk turned off difflib finds no popular tokens of
+        # its own, and Python 2 does not keep them around at all
+        self.bpopular = set()
+        n = len(self.b)
+        if n < self.popular_min_tokens:
+            return
+        limit = n * self.popularity + 1
+        popular = [
+            token for token, indices in self.b2j.items()
+            if len(indices) > limit
+        ]
+        for token in popular:
+            del self.b2j[token]
+        self.bpopular.update(popular)
+        LOG.debug('Dropped %s popular tokens from the index', len(popular))
+
+    def get_matching_blocks(self):
+        """
+        Return the matching blocks, re-aligning the gaps between them in
+        fast mode. A gap can only hold matches made up entirely of popular
+        tokens, so each gap is matched again with every token indexed.
+        """
+        if self.matching_blocks is not None:
+            return self.matching_blocks
+        blocks = SequenceMatcher.get_matching_blocks(self)
+        if self.accurate_mode or not self.bpopular:
+            return blocks
+
+        LOG.debug('Re-aligning popular tokens between matching blocks...')
+        realigned = []
+        i = j = 0
+        for ai, bj, size in blocks:
+            if i < ai and j < bj:
+                gap = SequenceMatcher(
+                    None, self.a[i:ai], self.b[j:bj], False
+                )
+                for gi, gj, gsize in gap.get_matching_blocks()[:-1]:
+                    realigned.append((i + gi, j + gj, gsize))
+            realigned.append((ai, bj, size))
+            i, j = ai + size, bj + size
+
+        # Collapse blocks which now touch each other
+        merged = []
+        for ai, bj, size in realigned:
+            if merged and size:
+                pi, pj, psize = merged[-1]
+                if pi + psize == ai and pj + psize == bj:
+                    merged[-1] = (pi, pj, psize + size)
+                    continue
+            merged.append((ai, bj, size))
+        self.matching_blocks = [Match._make(block) for block in merged]
+        return self.matching_blocks
 
     def split_html(self, t):
         LOG.debug('Splitting html into tag pieces and words')
-        result = []
-        t = utf8_decode(t)
-        for item in TagIter(t):
-            if item.startswith('<'):
-                result.append(item)
-            else:
-                result.extend(constants.WORD_RE.findall(item))
+        result = constants.TOKEN_RE.findall(utf8_decode(t))
+        # Text after the last tag which starts with an unclosed '<' is kept
+        # whole, as it always has been.
+        i = len(result)
+        while i and not (len(result[i - 1]) > 1 and result[i - 1][0] == '<'):
+            i -= 1
+        if i < len(result) and result[i] == '<':
+            result[i:] = [''.join(result[i:])]
         return result
 
-    def diff_html(self, insert_stylesheet=True):
+    def diff_html(self, insert_stylesheet=True, detect_moves=True):
         opcodes = self.get_opcodes()
-        a = self.a
-        b = self.b
-        out = SpooledBytesIO()
+        a = self.ta
+        b = self.tb
+        if detect_moves:
+            moved_from, moved_to = self.find_moves(opcodes)
+        else:
+            moved_from, moved_to = {}, {}
+        out = six.StringIO()
         for tag, i1, i2, j1, j2 in opcodes:
             LOG.debug('Processing opcodes for tag %s', tag)
             if tag == 'equal':
-                for item in a[i1:i2]:
-                    out.write(utf8_encode(item))
-            if tag == 'delete':
-                self.text_delete(a[i1:i2], out)
-            if tag == 'insert':
-                self.text_insert(b[j1:j2], out)
+                out.write(a.text(i1, i2))
+                continue
             if tag == 'replace':
                 if (self.is_invisible_change(a[i1:i2], b[j1:j2])):
-                    for item in b[j1:j2]:
-                        out.write(utf8_encode(item))
-                else:
-                    self.text_delete(a[i1:i2], out)
-                    self.text_insert(b[j1:j2], out)
+                    out.write(b.text(j1, j2))
+                    continue
+            if tag in ('delete', 'replace'):
+                for start, end in self.move_spans(a, i1, i2, moved_from):
+                    if start in moved_from:
+                        self.out_move_from(moved_from[start], out)
+                    else:
+                        self.text_delete(a[start:end], out)
+            if tag in ('insert', 'replace'):
+                for start, end in self.move_spans(b, j1, j2, moved_to):
+                    if start in moved_to:
+                        number, i, j = moved_to[start]
+                        orig = None
+                        if (self.move_key(self.a[i:j]) !=
+                                self.move_key(self.b[start:end])):
+                            orig = a[i:j]
+                        self.text_move_to(number, b[start:end], out, orig)
+                    else:
+                        self.text_insert(b[start:end], out)
         html = out.getvalue()
         out.close()
         if insert_stylesheet:
             html = self.insert_stylesheet(html)
         return html
 
+    def move_key(self, ids):
+        """
+        Return the ids of the words in a span of tokens, ignoring tags and
+        whitespace, for use as a key when pairing moved spans. Spans with
+        fewer than min_move_words words are never treated as moves.
+
+        :type ids: list
+        :param ids: list of token ids
+        :returns: tuple of word ids or None
+        """
+        kinds = self.kinds
+        key = tuple(
+            token_id for token_id in ids if kinds[token_id] == KIND_TEXT
+        )
+        if len(key) < self.min_move_words:
+            return None
+        return key
+
+    def block_spans(self, items, offset=0):
+        """
+        Split a span of tokens into the blocks it holds, cutting before
+        every block level start tag and after every block level end tag.
+
+        :type items: list
+        :param items: list of tokens
+        :type offset: integer
+        :param offset: position of the first token in its sequence
+        :returns: list of start and end positions of the blocks
+        """
+        spans = []
+        start = 0
+        for i, item in enumerate(items):
+            if not item.startswith('<'):
+                continue
+            name = constants.TAG_NAME_RE.match(item)
+            if not name or name.group(2).lower() not in constants.BLOCK_TAGS:
+                continue
+            cut = i + 1 if name.group(1) else i
+            if cut > start:
+                spans.append((offset + start, offset + cut))
+                start = cut
+        if start < len(items):
+            spans.append((offset + start, offset + len(items)))
+        return spans
+
+    def move_spans(self, tokens, lo, hi, moved):
+        """
+        Return the spans to render a changed run of tokens in, splitting it
+        into blocks only when there are moves for some of them to be.
+        """
+        if not moved:
+            return [(lo, hi)]
+        return self.block_spans(tokens[lo:hi], lo)
+
+    def find_moves(self, opcodes):
+        """
+        Pair deleted blocks with inserted blocks holding the same words.
+        Changed spans are first split into the blocks they hold, so a moved
+        paragraph is found even when deleted along with its neighbours. The
+        deleted blocks are indexed by their words so that each inserted
+        block is paired with a single lookup.
+
+        Blocks left over are then paired with deleted blocks holding nearly
+        the same words, kept if the ratio of their words is at least
+        move_ratio. Candidates are found through the runs of move_shingle
+        words they share. Runs held by more than move_bucket_size deleted
+        blocks are too common to tell blocks apart and are skipped. Only the
+        move_candidates blocks sharing the most runs are compared, and only
+        if they share at least move_min_shared of the inserted block's runs.
+
+        :type opcodes: list
+        :param opcodes: opcodes as returned by get_opcodes
+        :returns: a dict mapping the start of each moved block in the
+                  original sequence to its move number, and one mapping the
+                  start of each moved block in the new sequence to its move
+                  number and the span of the original it was moved from
+        """
+        LOG.debug('Looking for moved blocks...')
+        deleted = {}
+        for n, (tag, i1, i2, j1, j2) in enumerate(opcodes):
+            if tag in ('delete', 'replace'):
+                items = self.ta[i1:i2]
+                for start, end in self.block_spans(items, i1):
+                    key = self.move_key(self.a[start:end])
+                    if key is not None:
+                        deleted.setdefault(key, []).append((n, start, end))
+
+        moved_from = {}
+        moved_to = {}
+        inserted = []
+        for n, (tag, i1, i2, j1, j2) in enumerate(opcodes):
+            if tag not in ('insert', 'replace'):
+                continue
+            items = self.tb[j1:j2]
+            for j, k in self.block_spans(items, j1):
+                key = self.move_key(self.b[j:k])
+                if key is None:
+                    continue
+                for pos, (m, start, end) in enumerate(deleted.get(key, ())):
+                    # A replace whose words are unchanged is not a move
+                    if m != n:
+                        del deleted[key][pos]
+                        number = len(moved_to) + 1
+                        moved_from[start] = number
+                        moved_to[j] = (number, start, end)
+                        break
+                else:
+                    inserted.append((n, j, key))
+
+        shingles = {}
+        for key, candidates in deleted.items():
+            for shingle in self.move_shingles(key):
+                shingles.setdefault(shingle, []).extend(
+                    (key, m, start, end) for m, start, end in candidates
+                )
+        for n, j, key in inserted:
+            runs = self.move_shingles(key)
+            shared = Counter()
+            for shingle in runs:
+                bucket = shingles.get(shingle)
+                if bucket and len(bucket) <= self.move_bucket_size:
+                    shared.update(bucket)
+            least = self.move_min_shared * len(runs)
+            for (old, m, start, end), count in shared.most_common(
+                    self.move_candidates):
+                if count < least:
+                    break
+                if m == n or start in moved_from:
+                    continue
+                matcher = SequenceMatcher(None, old, key, False)
+                if (matcher.real_quick_ratio() >= self.move_ratio and
+                        matcher.quick_ratio() >= self.move_ratio and
+                        matcher.ratio() >= self.move_ratio):
+                    number = len(moved_to) + 1
+                    moved_from[start] = number
+                    moved_to[j] = (number, start, end)
+                    break
+        LOG.debug('Found %s moved blocks', len(moved_to))
+        return moved_from, moved_to
+
+    def move_shingles(self, key):
+        """Return the set of runs of move_shingle words in a move key."""
+        size = self.move_shingle
+        return set(key[i:i + size] for i in range(len(key) - size + 1))
+
     def is_invisible_change(self, seq1, seq2):
         LOG.debug('Checking if change is visible...')
         if len(seq1) != len(seq2):
@@ -243,24 +639,74 @@ class HTMLMatcher(SequenceMatcher):
             if item.startswith('<'):
                 self.out_insert(''.join(text), out)
                 text = []
-                out.write(utf8_encode(item))
+                out.write(item)
             else:
                 text.append(item)
         self.out_insert(''.join(text), out)
 
+    def text_move_to(self, number, lst, out, orig=None):
+        """
+        Write the new location of a moved span. When the words of the
+        original span differ from the moved ones it is given as orig, and
+        the changes made along with the move are marked within it.
+
+        :type number: integer
+        :param number: move number
+        :type lst: list
+        :param lst: tokens of the moved span
+        :param out: file like object to write to
+        :type orig: list
+        :param orig: tokens of the span at its original location
+        """
+        out.write(self.move_start_anchor.format(number))
+        if orig is None:
+            opcodes = [('equal', 0, 0, 0, len(lst))]
+        else:
+            opcodes = SequenceMatcher(None, orig, lst, False).get_opcodes()
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == 'equal':
+                self.text_move(lst[j1:j2], out)
+                continue
+            if tag in ('delete', 'replace'):
+                self.text_delete(orig[i1:i2], out)
+            if tag in ('insert', 'replace'):
+                self.text_insert(lst[j1:j2], out)
+        out.write(self.move_end_anchor.format(number))
+
+    def text_move(self, lst, out):
+        text = []
+        for item in lst:
+            if item.startswith('<'):
+                self.out_move(''.join(text), out)
+                text = []
+                out.write(item)
+            else:
+                text.append(item)
+        self.out_move(''.join(text), out)
+
+    def out_move_from(self, number, out):
+        out.write(self.move_from_text.format(number))
+
+    def out_move(self, s, out):
+        if not s.strip():
+            val = s
+        else:
+            val = ''.join((self.start_move_text, s, self.end_span_text))
+        out.write(val)
+
     def out_delete(self, s, out):
         if not s.strip():
             val = s
         else:
             val = ''.join((self.start_delete_text, s, self.end_span_text))
-        out.write(utf8_encode(val))
+        out.write(val)
 
     def out_insert(self, s, out):
         if not s.strip():
             val = s
         else:
             val = ''.join((self.start_insert_text, s, self.end_span_text))
-        out.write(utf8_encode(val))
+        out.write(val)
 
     def insert_stylesheet(self, html, stylesheet=None):
         """
@@ -277,20 +723,22 @@ class HTMLMatcher(SequenceMatcher):
         if not stylesheet:
             stylesheet = self.stylesheet
         LOG.debug('Inserting stylesheet...')
-        match = constants.HEAD_RE.search(utf8_decode(html))
+        html = utf8_decode(html)
+        match = constants.HEAD_RE.search(html)
         pos = match.end() if match else 0
         return ''.join((
-            utf8_decode(html[:pos]),
+            html[:pos],
             '\n<style type="text/css">\n',
             stylesheet,
             '</style>',
-            utf8_decode(html[pos:]),
+            html[pos:],
         ))
 
 
-def diff_strings(orig, new, accurate_mode):
+def diff_strings(orig, new, accurate_mode, popularity=None):
     """
-    Given two strings of html, return a diffed string.
+    Given two strings of html, return a diffed string. Either string may
+    instead be a list of tokens or a Snapshot read by read_snapshot.
 
     :type orig: string
     :param orig: original string for comparison
@@ -298,20 +746,138 @@ def diff_strings(orig, new, accurate_mode):
     :param new: new string for comparision against original string
     :type accurate_moode: boolean
     :param accurate_moode: use accurate mode or not
+    :type popularity: float
+    :param popularity: fraction of a document above which a token is
+                       popular in fast mode
     :returns: string containing diffed html
     """
-    # Make sure we are dealing with bytes...
-    orig = utf8_encode(orig)
-    new = utf8_encode(new)
+    # Make sure we are dealing with text...
+    orig = as_source(orig)
+    new = as_source(new)
     LOG.debug('Beginning to diff strings...')
-    h = HTMLMatcher(orig, new, accurate_mode)
+    h = HTMLMatcher(orig, new, accurate_mode, popularity)
     return h.diff_html(True)
 
 
-def diff_files(initial_path, new_path, accurate_mode):
+def diff_summary(orig, new, accurate_mode=False, cutoff=None,
+                 popularity=None):
+    """
+    Given two strings of html, return a summary of the changes between them
+    without rendering a diff.
+
+    Identical inputs return immediately without being tokenized. If a cutoff
+    is given and the cheap upper bounds on the similarity ratio already fall
+    below it, the summary is returned before any matching is done. The ratio
+    and change counts are then left as None and the upper bound is given as
+    ratio_bound instead.
+
+    :type orig: string
+    :param orig: original string for comparison
+    :type new: string
+    :param new: new string for comparision against original string
+    :type accurate_mode: boolean
+    :param accurate_mode: use accurate mode or not
+    :type cutoff: float
+    :param cutoff: optional similarity ratio below which to stop early
+    :type popularity: float
+    :param popularity: fraction of a document above which a token is
+                       popular in fast mode
+    :returns: dict with the keys changed, ratio, ratio_bound,
+              inserted_words, deleted_words, inserted_tags and deleted_tags
+    """
+    orig = as_source(orig)
+    new = as_source(new)
+    summary = {
+        'changed': False,
+        'ratio': 1.0,
+        'ratio_bound': None,
+        'inserted_words': 0,
+        'deleted_words': 0,
+        'inserted_tags': 0,
+        'deleted_tags': 0,
+    }
+    if orig == new:
+        LOG.debug('Inputs are identical, skipping diff')
+        return summary
+
+    LOG.debug('Beginning to summarize differences...')
+    h = HTMLMatcher(orig, new, accurate_mode, popularity)
+    if cutoff is not None:
+        bound = h.real_quick_ratio()
+        if bound >= cutoff:
+            bound = h.quick_ratio()
+        if bound < cutoff:
+            LOG.debug('Ratio upper bound %s is below cutoff', bound)
+            summary.update({
+                'changed': True,
+                'ratio': None,
+                'ratio_bound': bound,
+                'inserted_words': None,
+                'deleted_words': None,
+                'inserted_tags': None,
+                'deleted_tags': None,
+            })
+            return summary
+
+    a = h.ta
+    b = h.tb
+    kinds = h.kinds
+    for tag, i1, i2, j1, j2 in h.get_opcodes():
+        if tag == 'equal':
+            continue
+        summary['changed'] = True
+        if tag == 'replace' and h.is_invisible_change(a[i1:i2], b[j1:j2]):
+            # Only whitespace and tags differ, pair by pair
+            for before, after in zip(a[i1:i2], b[j1:j2]):
+                if before != after and before.startswith('<'):
+                    summary['deleted_tags'] += 1
+                    summary['inserted_tags'] += 1
+            continue
+        for token_id in h.a[i1:i2]:
+            if kinds[token_id] == KIND_TAG:
+                summary['deleted_tags'] += 1
+            elif kinds[token_id] == KIND_TEXT:
+                summary['deleted_words'] += 1
+        for token_id in h.b[j1:j2]:
+            if kinds[token_id] == KIND_TAG:
+                summary['inserted_tags'] += 1
+            elif kinds[token_id] == KIND_TEXT:
+                summary['inserted_words'] += 1
+    summary['ratio'] = h.ratio()
+    return summary
+
+
+def read_html(path):
+    """
+    Read an html file and strip any comments from it.
+
+    :type path: string
+    :param path: path of the file to read
+    :returns: string containing the file contents without comments
+    """
+    with io.open(path, encoding='utf-8') as f:
+        LOG.debug('Reading file: {0}'.format(path))
+        return constants.COMMENT_RE.sub('', f.read())
+
+
+def read_source(path):
+    """
+    Read a file to be diffed, which may be either an html file or a
+    snapshot of one.
+
+    :type path: string
+    :param path: path of the file to read
+    :returns: string of html or Snapshot
+    """
+    if is_snapshot(path):
+        return read_snapshot(path)
+    return read_html(path)
+
+
+def diff_files(initial_path, new_path, accurate_mode, popularity=None):
     """
     Given two files, open them to variables and pass them to diff_strings
-    for diffing.
+    for diffing. Either file may be a snapshot written by write_snapshot.
 
     :type initial_path: object
     :param initial_path: initial file to diff against
@@ -319,18 +885,14 @@ def diff_files(initial_path, new_path, accurate_mode):
     :param new_path: new file to compare to f1
     :type accurate_mode: boolean
     :param accurate_mode: use accurate mode or not
+    :type popularity: float
+    :param popularity: fraction of a document above which a token is
+                       popular in fast mode
     :returns: string containing diffed html from initial_path and new_path
     """
-    # Open the files
-    with open(initial_path) as f:
-        LOG.debug('Reading file: {0}'.format(initial_path))
-        source1 = constants.COMMENT_RE.sub('', f.read())
-
-    with open(new_path) as f:
-        LOG.debug('Reading file: {0}'.format(new_path))
-        source2 = constants.COMMENT_RE.sub('', f.read())
-
-    return diff_strings(source1, source2, accurate_mode)
+    source1 = read_source(initial_path)
+    source2 = read_source(new_path)
+    return diff_strings(source1, source2, accurate_mode, popularity)
 
 
 def whitespacegen(spaces):
@@ -383,6 +945,33 @@ def span_to_whitespace(html_string, span):
     return html_string
 
 
+def moved_texts(html_string):
+    """
+    Given a diffed html string, find the html of every moved block at its
+    new location, as it read at its original location, so it can be shown
+    again there. Text inserted along with the move is left out, and the
+    move and delete markup is removed from the rest.
+
+    :type html_string: string
+    :param html_string: string of diffed html to parse
+    :returns: dict mapping move numbers to the html that was moved
+    """
+    LOG.debug('Collecting moved text...')
+    texts = {}
+    for match in constants.MOVE_FROM_RE.finditer(html_string):
+        number = match.group(1)
+        try:
+            s = html_string.index('<a id="move-{0}"></a>'.format(number))
+            f = html_string.index('<a id="move-{0}-end"></a>'.format(number))
+        except ValueError:
+            texts[number] = ''
+        else:
+            moved = constants.INSERT_SPAN_RE.sub('', html_string[s:f])
+            moved = constants.MOVE_ANCHOR_RE.sub('', moved)
+            texts[number] = constants.MOVED_SPAN_RE.sub(r'\1', moved)
+    return texts
+
+
 def gen_side_by_side(file_string):
     """
     Given an html file as a string, return a new html file with side by
@@ -410,6 +999,31 @@ def gen_side_by_side(file_string):
     LOG.debug('Converting delete spans to whitespace...')
     right = span_to_whitespace(right_side, 'delete')
 
+    # Moved blocks show on the left at their original location and on the
+    # right at their new one.
+    texts = moved_texts(body)
+    if texts:
+        LOG.debug('Converting moved blocks...')
+        left = span_to_whitespace(left, 'move')
+        left = constants.MOVE_SPAN_RE.sub(
+            lambda m: span_to_whitespace(m.group(0), 'delete'), left
+        )
+        left = constants.MOVE_ANCHOR_RE.sub('', left)
+        left = constants.MOVE_FROM_RE.sub(
+            lambda m: ''.join((
+                '<span class="move" id="move-{0}-from">'.format(m.group(1)),
+                texts[m.group(1)],
+                '</span>',
+            )),
+            left
+        )
+        right = constants.MOVE_FROM_RE.sub(
+            lambda m: whitespacegen(
+                get_spacing(strip_tags(texts[m.group(1)]), 'times new roman')
+            ),
+            right
+        )
+
     # Create side-by-side diff
     sbs_diff = (
         '%(start)s%(container)s%(orig_start)s%(left)s%(div_end)s%(new_start)s'
@@ -426,3 +1040,237 @@ def gen_side_by_side(file_string):
         }
     )
     return sbs_diff
+
+
+def split_blocks(body):
+    """
+    Divide the body of an html document into its top level blocks. A block
+    ends wherever a block level tag is closed with nothing left open
+    around it. Paragraphs, list items and definition terms may be closed
+    implicitly by the start of a following block, as browsers do.
+
+    :type body: string
+    :param body: string of html from inside the body tags
+    :returns: list of strings which join back into the original body
+    """
+    LOG.debug('Splitting body into blocks...')
+    blocks = []
+    stack = []
+    pos = 0
+    for match in constants.TAG_RE.finditer(body):
+        tag = match.group(0)
+        name = constants.TAG_NAME_RE.match(tag)
+        if not name or name.group(2).lower() not in constants.BLOCK_TAGS:
+            continue
+        name, closing = name.group(2).lower(), name.group(1)
+        if closing:
+            if name in stack:
+                del stack[len(stack) - stack[::-1].index(name) - 1:]
+            if not stack:
+                blocks.append(body[pos:match.end()])
+                pos = match.end()
+            continue
+        if tag.endswith('/>'):
+            continue
+        while stack and name in constants.IMPLIED_END_TAGS.get(stack[-1], ()):
+            stack.pop()
+            if not stack and pos < match.start():
+                blocks.append(body[pos:match.start()])
+                pos = match.start()
+        stack.append(name)
+    if pos < len(body):
+        blocks.append(body[pos:])
+    return blocks
+
+
+def open_block(block):
+    """
+    Divide a block into the text before its outermost block level tag, that
+    start tag and the html inside it, leaving out its end tag.
+
+    :type block: string
+    :param block: string of html as returned by split_blocks
+    :returns: tuple of prefix, start tag and inner html, or None if the
+              block does not open with a block level tag
+    """
+    for match in constants.TAG_RE.finditer(block):
+        tag = match.group(0)
+        name = constants.TAG_NAME_RE.match(tag)
+        if not name or name.group(2).lower() not in constants.BLOCK_TAGS:
+            continue
+        if name.group(1) or tag.endswith('/>'):
+            return None
+        inner = block[match.end():]
+        last = inner.rfind('<')
+        end = constants.TAG_NAME_RE.match(inner, max(last, 0))
+        if (end and end.group(1) and inner.endswith('>') and
+                end.group(2).lower() == name.group(2).lower()):
+            inner = inner[:last]
+        return block[:match.start()], tag, inner
+    return None
+
+
+def nest_blocks(body, page_size, context=(), offset=0):
+    """
+    Divide the body of an html document into blocks no larger than
+    page_size where possible, descending into larger blocks and splitting
+    them at their own nested blocks.
+
+    Every block comes with its context, the start tags of the blocks it was
+    taken from, outermost first. Each start tag is paired with its offset
+    in the body so that sibling blocks opened by equal tags stay apart.
+
+    :type body: string
+    :param body: string of html from inside the body tags
+    :type page_size: integer
+    :param page_size: number of characters above which to descend
+    :returns: list of context and block string pairs
+    """
+    blocks = []
+    for block in split_blocks(body):
+        parts = len(block) > page_size and open_block(block)
+        if parts:
+            prefix, tag, inner = parts
+            if prefix:
+                blocks.append((context, prefix))
+            start = offset + len(prefix)
+            blocks.extend(nest_blocks(
+                inner, page_size, context + ((start, tag),), start + len(tag)
+            ))
+        else:
+            blocks.append((context, block))
+        offset += len(block)
+    return blocks
+
+
+def wrap_blocks(blocks):
+    """
+    Join blocks returned by nest_blocks back into html, opening and closing
+    the tags of their contexts around them as needed.
+
+    :type blocks: list
+    :param blocks: context and block string pairs
+    :returns: string of html
+    """
+    out = []
+    stack = ()
+    for context, block in blocks:
+        keep = 0
+        while (keep < len(stack) and keep < len(context) and
+               stack[keep] == context[keep]):
+            keep += 1
+        out.extend(end_tag(tag) for start, tag in reversed(stack[keep:]))
+        out.extend(tag for start, tag in context[keep:])
+        out.append(block)
+        stack = context
+    out.extend(end_tag(tag) for start, tag in reversed(stack))
+    return ''.join(out)
+
+
+def end_tag(tag):
+    """Return the end tag matching a start tag."""
+    return '</{0}>'.format(constants.TAG_NAME_RE.match(tag).group(2))
+
+
+def link_moves(pages, page_name):
+    """
+    Point the links from the old location of moved text at the page
+    holding its new location, wherever the two ended up on different pages.
+
+    :type pages: list
+    :param pages: html strings of the pages, in order
+    :type page_name: string
+    :param page_name: format string giving the file name of a page number
+    :returns: list of html strings with the links rewritten
+    """
+    targets = {}
+    for number, page in enumerate(pages, 1):
+        for match in constants.MOVE_TARGET_RE.finditer(page):
+            targets[match.group(1)] = number
+
+    def rewrite(number):
+        def replace(match):
+            target = targets.get(match.group(1), number)
+            if target == number:
+                return match.group(0)
+            return match.group(0).replace(
+                'href="#', 'href="{0}#'.format(page_name.format(target))
+            )
+        return replace
+
+    return [
+        constants.MOVE_FROM_RE.sub(rewrite(number), page)
+        for number, page in enumerate(pages, 1)
+    ]
+
+
+def gen_paged(file_string, page_name='page-{0:04d}.html', page_size=50000):
+    """
+    Given a diffed html file as a string, split it at block boundaries into
+    numbered pages along with an index page. Blocks larger than a page are
+    split at the blocks nested within them, with their enclosing tags
+    opened again on every page. Pages hold either changed or unchanged
+    blocks, never both. The index includes the changed pages
+    inline and links to the unchanged ones so they are loaded on demand.
+
+    :type file_string: string
+    :param file_string: string of diffed html to split
+    :type page_name: string
+    :param page_name: format string giving the file name of a page number
+    :type page_size: integer
+    :param page_size: number of characters after which to start a new page
+    :returns: the index html string and a list of page html strings
+    """
+    LOG.debug('Attempting to generate paged diff from text.')
+    start, body, ending = split_html(file_string)
+
+    chunks = []
+    size = 0
+    for context, block in nest_blocks(body, page_size):
+        changed = bool(constants.CHANGE_RE.search(block))
+        if (chunks and chunks[-1][0] == changed and
+                size + len(block) <= page_size):
+            chunks[-1][1].append((context, block))
+            size += len(block)
+        else:
+            chunks.append((changed, [(context, block)]))
+            size = len(block)
+    changes = [changed for changed, blocks in chunks]
+    chunks = [wrap_blocks(blocks) for changed, blocks in chunks]
+
+    pages = []
+    contents = []
+    index = []
+    linked = link_moves(chunks, page_name)
+    for number, changed in enumerate(changes, 1):
+        name = page_name.format(number)
+        pages.append(''.join((start, linked[number - 1], ending)))
+        if changed:
+            contents.append('<li><a href="#page-{0}">Page {0}</a></li>'.format(
+                number
+            ))
+            # Moves only ever land on changed pages, all of which are
+            # inlined here, so the links within the index stay local
+            index.append(''.join((
+                '<div id="page-{0}">'.format(number),
+                chunks[number - 1],
+                '</div>',
+            )))
+        else:
+            index.append(
+                '<p class="unchanged"><a href="{0}">Page {1} '
+                '(unchanged)</a></p>'.format(name, number)
+            )
+    LOG.debug(
+        'Split diff into %s pages, %s changed', len(pages), len(contents)
+    )
+
+    index_html = ''.join((
+        start,
+        '<ul class="changedPages">',
+        ''.join(contents),
+        '</ul>',
+        ''.join(index),
+        ending,
+    ))
+    return index_html, pages
@@ -0,0 +1,266 @@
+"""
+Snapshot
+--------
+Compact pre-tokenized storage of html documents
+
+A snapshot file holds the tokens of a document as produced by
+HTMLMatcher.split_html so that it can be diffed without being parsed again.
+Every distinct token is stored once in a vocabulary along with a kind flag,
+and the document itself is stored as an array of vocabulary ids, two bytes
+wide when the vocabulary is small enough and four bytes otherwise. All
+values are little-endian unsigned integers so the id array can be used
+straight from a memory map.
+
+Layout::
+
+    magic           8 bytes
+    header          vocabulary size, token count, vocabulary blob size,
+                    id width
+    offsets         vocabulary size + 1 uint32 offsets into the blob
+    kinds           vocabulary size uint8 kind flags
+    padding         zero bytes up to a multiple of four
+    blob            utf-8 encoded vocabulary
+    padding         zero bytes up to a multiple of four
+    ids             token count uint16 or uint32 vocabulary ids
+"""
+# Standard
+import io
+import sys
+import mmap
+import array
+import struct
+import logging
+
+# Six
+import six
+
+# Project
+from htmldiff import constants
+
+LOG = logging.getLogger(__name__)
+
+MAGIC = b'HDSNAP1\n'
+HEADER = struct.Struct('<IIII')
+TYPECODES = {2: 'H', 4: 'I'}
+
+KIND_TEXT = 0
+KIND_SPACE = 1
+KIND_TAG = 2
+
+
+def token_kind(token):
+    """Return the kind flag of a token."""
+    if token.startswith('<'):
+        return KIND_TAG
+    if constants.WS_RE.match(token):
+        return KIND_SPACE
+    return KIND_TEXT
+
+
+def _pad(length):
+    return b'\0' * (-length % 4)
+
+
+def _uint_bytes(values, width=4):
+    arr = array.array(TYPECODES[width], values)
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    if six.PY2:
+        return arr.tostring()
+    return arr.tobytes()
+
+
+class Snapshot(object):
+    """
+    The tokens of a document stored as an interned vocabulary, a kind flag
+    for every vocabulary entry and a sequence of vocabulary ids.
+    """
+
+    def __init__(self, vocab, kinds, ids):
+        self.vocab = vocab
+        self.kinds = kinds
+        self.ids = ids
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        """
+        Build a snapshot from a list of tokens.
+
+        :type tokens: list
+        :param tokens: tokens as returned by HTMLMatcher.split_html
+        :returns: Snapshot
+        """
+        vocab = []
+        lookup = {}
+        ids = []
+        for token in tokens:
+            token_id = lookup.get(token)
+            if token_id is None:
+                token_id = lookup[token] = len(vocab)
+                vocab.append(token)
+            ids.append(token_id)
+        kinds = [token_kind(token) for token in vocab]
+        return cls(vocab, kinds, ids)
+
+    def tokens(self):
+        """Return the list of tokens making up the document."""
+        vocab = self.vocab
+        return [vocab[token_id] for token_id in self.ids]
+
+    def dumps(self):
+        """Return the snapshot serialized to bytes."""
+        encoded = [token.encode('utf-8') for token in self.vocab]
+        offsets = [0]
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        blob = b''.join(encoded)
+        kinds = bytearray(self.kinds)
+        width = 2 if len(self.vocab) <= 0xFFFF else 4
+
+        out = io.BytesIO()
+        out.write(MAGIC)
+        out.write(HEADER.pack(
+            len(self.vocab), len(self.ids), len(blob), width
+        ))
+        out.write(_uint_bytes(offsets))
+        out.write(bytes(kinds))
+        out.write(_pad(len(kinds)))
+        out.write(blob)
+        out.write(_pad(len(blob)))
+        out.write(_uint_bytes(self.ids, width))
+        return out.getvalue()
+
+    @classmethod
+    def loads(cls, data):
+        """
+        Load a snapshot from bytes or any buffer, such as a memory map. On
+        little-endian machines running Python 3 the ids are a view onto the
+        buffer rather than a copy.
+
+        :param data: serialized snapshot
+        :returns: Snapshot
+        """
+        view = memoryview(data)
+        try:
+            return cls._load_view(view)
+        finally:
+            # Only the ids may still refer to the buffer, so a memory map
+            # can be closed as soon as they are dropped, even after an error.
+            # Python 2 views can not be released, nor do they hold the
+            # buffer open.
+            if not six.PY2:
+                view.release()
+
+    @classmethod
+    def _load_view(cls, view):
+        if view[:len(MAGIC)].tobytes() != MAGIC:
+            raise ValueError('This is not an htmldiff snapshot.')
+        pos = len(MAGIC)
+        if len(view) < pos + HEADER.size:
+            raise ValueError('Snapshot header is truncated.')
+        vocab_size, token_count, blob_size, width = HEADER.unpack_from(
+            view, pos
+        )
+        if width not in TYPECODES:
+            raise ValueError(
+                'Unsupported snapshot id width: {0}'.format(width)
+            )
+        pos += HEADER.size
+        expected = (
+            pos + 4 * (vocab_size + 1) +
+            vocab_size + len(_pad(vocab_size)) +
+            blob_size + len(_pad(blob_size)) +
+            width * token_count
+        )
+        if len(view) != expected:
+            raise ValueError(
+                'Snapshot is {0} bytes long, its header gives {1}.'.format(
+                    len(view), expected
+                )
+            )
+
+        offsets = struct.unpack_from('<{0}I'.format(vocab_size + 1), view, pos)
+        pos += 4 * (vocab_size + 1)
+        kinds = view[pos:pos + vocab_size].tobytes()
+        pos += vocab_size + len(_pad(vocab_size))
+        blob = view[pos:pos + blob_size].tobytes()
+        pos += blob_size + len(_pad(blob_size))
+        if offsets[-1] != blob_size or any(
+            offsets[i] > offsets[i + 1] for i in range(vocab_size)
+        ):
+            raise ValueError('Snapshot vocabulary offsets are corrupt.')
+
+        # Python 2 can only intern byte strings
+        intern = six.moves.intern if six.PY3 else six.text_type
+        vocab = [
+            intern(blob[offsets[i]:offsets[i + 1]].decode('utf-8'))
+            for i in range(vocab_size)
+        ]
+        ids = _read_uint(view, pos, token_count, width)
+        if token_count and max(ids) >= vocab_size:
+            ids = None
+            raise ValueError('Snapshot ids are outside of its vocabulary.')
+        return cls(vocab, bytearray(kinds), ids)
+
+
+def _read_uint(view, pos, count, width=4):
+    section = view[pos:pos + width * count]
+    if sys.byteorder == 'little' and not six.PY2:
+        return section.cast(TYPECODES[width])
+    arr = array.array(TYPECODES[width])
+    if six.PY2:
+        arr.fromstring(section.tobytes())
+    else:
+        arr.frombytes(section.tobytes())
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr
+
+
+def is_snapshot(path):
+    """Return True if the file at path is a snapshot."""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_snapshot(tokens, path):
+    """
+    Write a list of tokens to a snapshot file.
+
+    :type tokens: list
+    :param tokens: tokens as returned by HTMLMatcher.split_html
+    :type path: string
+    :param path: path of the snapshot file to write
+    """
+    LOG.debug('Writing snapshot: {0}'.format(path))
+    with open(path, 'wb') as f:
+        f.write(Snapshot.from_tokens(tokens).dumps())
+
+
+def read_snapshot(path):
+    """
+    Read a snapshot file, memory mapping the file. The ids are copied out
+    of the map in one go so it can be closed before returning.
+
+    :type path: string
+    :param path: path of the snapshot file to read
+    :returns: Snapshot
+    """
+    LOG.debug('Reading snapshot: {0}'.format(path))
+    with open(path, 'rb') as f:
+        if six.PY2:
+            # Python 2 memory maps can not be viewed without copying them
+            return Snapshot.loads(f.read())
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        snapshot = Snapshot.loads(mapped)
+        view = snapshot.ids
+        if isinstance(view, memoryview):
+            try:
+                snapshot.ids = array.array(view.format)
+                snapshot.ids.frombytes(view.tobytes())
+            finally:
+                view.release()
+    finally:
+        mapped.close()
+    return snapshot
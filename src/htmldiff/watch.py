@@ -0,0 +1,123 @@
+"""
+Watch
+-----
+Re-diff a pair of files whenever either of them changes on disk
+"""
+# Standard
+import time
+import hashlib
+import logging
+
+# Boltons
+from boltons.fileutils import atomic_save
+
+# Project
+from htmldiff import constants
+from htmldiff.lib import HTMLMatcher, gen_side_by_side
+from htmldiff.snapshot import MAGIC, Snapshot
+
+LOG = logging.getLogger(__name__)
+
+
+class WatchedFile(object):
+    """
+    A file on disk along with the tokens of its last seen contents. The
+    file may be either an html file or a snapshot of one.
+
+    The file is read and hashed on every refresh, which is cheap next to
+    tokenizing, and only re-tokenized when that hash changes. Tokens stay
+    pending until the watcher has used them in a successful render.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.digest = None
+        self.tokens = None
+        self.pending = False
+
+    def refresh(self, matcher):
+        """
+        Check the file for changes, re-tokenizing it if needed.
+
+        :type matcher: HTMLMatcher
+        :param matcher: matcher used to tokenize the file
+        :returns: True if the file contents changed since the last refresh
+        """
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        if digest == self.digest:
+            return False
+
+        if data.startswith(MAGIC):
+            LOG.debug('Loading snapshot: {0}'.format(self.path))
+            source = Snapshot.loads(data)
+        else:
+            LOG.debug('Tokenizing file: {0}'.format(self.path))
+            source = constants.COMMENT_RE.sub('', data.decode('utf-8'))
+        self.tokens = matcher.tokenize(source)
+        self.digest = digest
+        self.pending = True
+        return True
+
+
+class DiffWatcher(object):
+    """
+    Keep two files diffed into an output file, re-rendering on change.
+
+    The tokens of both inputs are kept in memory between runs. The
+    matcher's index of the new file is kept as well, so that when only the
+    original file changes just that file is tokenized and matched again.
+    """
+
+    def __init__(self, initial_path, new_path, output_path, accurate_mode,
+                 side_by_side=False, interval=0.5, popularity=None):
+        self.initial = WatchedFile(initial_path)
+        self.new = WatchedFile(new_path)
+        self.output_path = output_path
+        self.side_by_side = side_by_side
+        self.interval = interval
+        self.matcher = HTMLMatcher('', '', accurate_mode, popularity)
+
+    def poll(self):
+        """
+        Re-render the output file if either input has changed.
+
+        :returns: True if the output file was written
+        """
+        # Refresh both files before touching the matcher, so a failure
+        # reading either one leaves the other's new tokens pending for the
+        # next poll.
+        self.initial.refresh(self.matcher)
+        self.new.refresh(self.matcher)
+        if not (self.initial.pending or self.new.pending):
+            return False
+
+        # SequenceMatcher indexes its second sequence, setting the first one
+        # alone leaves that index in place.
+        if self.initial.pending:
+            self.matcher.set_seq1(self.initial.tokens)
+        if self.new.pending:
+            self.matcher.set_seq2(self.new.tokens)
+        self.matcher.compact_vocab()
+
+        diffed_html = self.matcher.diff_html(True)
+        if self.side_by_side:
+            diffed_html = gen_side_by_side(diffed_html)
+        with atomic_save(self.output_path) as f:
+            f.write(diffed_html.encode('utf-8'))
+        self.initial.pending = self.new.pending = False
+        LOG.info('Wrote diff to {0}'.format(self.output_path))
+        return True
+
+    def run(self):
+        """Poll the input files until interrupted."""
+        LOG.info('Watching {0} and {1} for changes...'.format(
+            self.initial.path, self.new.path
+        ))
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                LOG.exception('Diff process exited with an error')
+            time.sleep(self.interval)
@@ -1,16 +1,511 @@
 import unittest
+import shutil
 import sys
 import os
+import tempfile
+
+from htmldiff import constants
+from htmldiff import lib
+from htmldiff import snapshot
+from htmldiff.entry_point import format_summary
+from htmldiff.watch import DiffWatcher
+
+DOC = u'<html><head><title>t</title></head><body>{0}</body></html>'
+
 
 class DiffTest(unittest.TestCase):
 
     def setUp(self):
-       pass
+        pass
 
     def test_risky_mode(self):
-	pass
+        pass
+
     def test_accurate_mode(self):
         pass
 
+
+class TokenizeTest(unittest.TestCase):
+
+    cases = [
+        '',
+        'plain words only',
+        '<p>Hello, world (again) - x=1; y/2 #3 &amp; done.</p>',
+        '<p>a&nbsp;&nbsp;b \t\n c</p>',
+        '<p>one</p> trailing text',
+        'a < b and c > d',
+        '<p>text</p> then an unclosed < tag',
+        '<p>text</p><',
+        '<p>text</p>< and <b>',
+        '<script type="text/javascript">if (a < b) { x(); }</script><p>x</p>',
+        '<script>unclosed script <p>para</p>',
+        '<p\nclass="multi\nline">w\u00f6rds</p>',
+    ]
+
+    def reference(self, html):
+        tokens = []
+        for item in lib.TagIter(html):
+            if item.startswith('<'):
+                tokens.append(item)
+            else:
+                tokens.extend(constants.WORD_RE.findall(item))
+        return tokens
+
+    def test_split_html(self):
+        matcher = lib.HTMLMatcher('', '', True)
+        for html in self.cases:
+            self.assertEqual(
+                matcher.split_html(html), self.reference(html), html
+            )
+
+    def test_offsets(self):
+        matcher = lib.HTMLMatcher('', '', True)
+        for html in self.cases:
+            tokens = matcher.tokenize(html)
+            items = self.reference(html)
+            self.assertEqual(tokens[:], items)
+            self.assertEqual(len(tokens), len(items))
+            self.assertEqual(tokens.text(0, len(tokens)), ''.join(items))
+            for i, item in enumerate(items):
+                self.assertEqual(tokens[i], item)
+
+    def test_shared_ids(self):
+        matcher = lib.HTMLMatcher('<p>a b</p>', '<p>b c</p>', True)
+        self.assertEqual(matcher.a[0], matcher.b[0])
+        self.assertEqual(matcher.a[3], matcher.b[1])
+        self.assertNotEqual(matcher.a[1], matcher.b[3])
+
+    def test_token_list(self):
+        matcher = lib.HTMLMatcher('', '', True)
+        items = self.reference(self.cases[2])
+        tokens = matcher.tokenize(items)
+        self.assertEqual(tokens[:], items)
+        self.assertIs(matcher.tokenize(tokens), tokens)
+
+
+class FastModeTest(unittest.TestCase):
+
+    def table(self, rows, changed=None):
+        cells = []
+        for i in range(rows):
+            value = 'changed' if i == changed else str(i)
+            cells.append('<tr><td>{0}</td><td>row</td></tr>'.format(value))
+        return DOC.format('<table>{0}</table>'.format(''.join(cells)))
+
+    def test_table(self):
+        orig = self.table(300)
+        new = self.table(300, changed=150)
+        matcher = lib.HTMLMatcher(orig, new, False)
+        self.assertTrue(matcher.bpopular)
+        self.assertIn(matcher.vocab['<td>'], matcher.bpopular)
+        fast = matcher.diff_html()
+        self.assertEqual(fast, lib.diff_strings(orig, new, True))
+        self.assertEqual(fast.count('class="insert"'), 1)
+        self.assertEqual(fast.count('class="delete"'), 1)
+
+    def test_small_documents_keep_popular_tokens(self):
+        orig = self.table(10)
+        matcher = lib.HTMLMatcher(orig, self.table(10, changed=5), False)
+        self.assertFalse(matcher.bpopular)
+
+
+class SummaryTest(unittest.TestCase):
+
+    def test_identical(self):
+        html = DOC.format('<p>Same text here.</p>')
+        summary = lib.diff_summary(html, html)
+        self.assertFalse(summary['changed'])
+        self.assertEqual(summary['ratio'], 1.0)
+        self.assertEqual(summary['inserted_words'], 0)
+
+    def test_counts(self):
+        orig = DOC.format('<p>Hello world, this is a test.</p>')
+        new = DOC.format('<p>Hello there world, this is test.</p><hr/>')
+        summary = lib.diff_summary(orig, new, True)
+        self.assertTrue(summary['changed'])
+        self.assertEqual(summary['inserted_words'], 1)
+        self.assertEqual(summary['deleted_words'], 1)
+        self.assertEqual(summary['inserted_tags'], 1)
+        self.assertEqual(summary['deleted_tags'], 0)
+        self.assertIsNone(summary['ratio_bound'])
+        self.assertLess(summary['ratio'], 1.0)
+
+    def test_cutoff(self):
+        orig = DOC.format('<p>One two three four five.</p>')
+        new = DOC.format('<p>Something else entirely, with more words.</p>')
+        summary = lib.diff_summary(orig, new, True, cutoff=0.99)
+        self.assertTrue(summary['changed'])
+        self.assertIsNone(summary['ratio'])
+        self.assertIsNone(summary['inserted_words'])
+        self.assertLess(summary['ratio_bound'], 0.99)
+
+    def test_tag_only_change(self):
+        orig = DOC.format('<p>Hello <b>world</b></p>')
+        new = DOC.format('<p>Hello <i>world</i></p>')
+        summary = lib.diff_summary(orig, new, True)
+        self.assertTrue(summary['changed'])
+        self.assertEqual(summary['inserted_tags'], 2)
+        self.assertEqual(summary['deleted_tags'], 2)
+        self.assertEqual(summary['inserted_words'], 0)
+
+    def test_whitespace_only_change(self):
+        orig = DOC.format('<p>Hello world</p>')
+        new = DOC.format('<p>Hello  world</p>')
+        summary = lib.diff_summary(orig, new, True)
+        self.assertTrue(summary['changed'])
+        self.assertEqual(summary['inserted_words'], 0)
+        self.assertEqual(summary['inserted_tags'], 0)
+
+    def test_format(self):
+        orig = DOC.format('<p>One two three four five.</p>')
+        new = DOC.format('<p>Something else entirely, with more words.</p>')
+        for cutoff in (None, 0.99):
+            text = format_summary(
+                lib.diff_summary(orig, new, True, cutoff=cutoff)
+            )
+            self.assertIsInstance(text, type(u''))
+            self.assertTrue(text.startswith('changed: yes\n'))
+
+    def test_cutoff_not_reached(self):
+        orig = DOC.format('<p>One two three four five.</p>')
+        new = DOC.format('<p>One two three four six.</p>')
+        summary = lib.diff_summary(orig, new, True, cutoff=0.5)
+        self.assertIsNone(summary['ratio_bound'])
+        self.assertEqual(summary['inserted_words'], 1)
+
+
+class MoveTest(unittest.TestCase):
+
+    paras = ''.join(
+        '<p>Paragraph number {0} here.</p>'.format(i) for i in range(3)
+    )
+
+    def diff(self, moved, changed):
+        return lib.diff_strings(
+            DOC.format(moved + self.paras),
+            DOC.format(self.paras + changed),
+            True
+        )
+
+    def test_exact_move(self):
+        moved = '<p>These words are moving to the end.</p>'
+        html = self.diff(moved, moved)
+        self.assertIn(
+            '<a class="move" id="move-1-from" href="#move-1">[moved]</a>', html
+        )
+        self.assertIn(
+            '<a id="move-1"></a><p><span class="move">These words are moving '
+            'to the end.</span></p><a id="move-1-end"></a>', html
+        )
+        self.assertNotIn('class="insert"', html)
+        self.assertNotIn('class="delete"', html)
+
+    def test_near_move(self):
+        html = self.diff(
+            '<p>These words are moving to the very end of it.</p>',
+            '<p>These words are moving to the far end of it.</p>'
+        )
+        self.assertIn('id="move-1-from"', html)
+        self.assertIn(
+            '<span class="move">These words are moving to the </span>'
+            '<span class="delete">very</span>'
+            '<span class="insert">far</span>'
+            '<span class="move"> end of it.</span>', html
+        )
+        texts = lib.moved_texts(html)
+        self.assertEqual(texts, {
+            '1': '<p>These words are moving to the very end of it.</p>'
+        })
+
+    def test_move_deleted_with_neighbour(self):
+        alpha = '<p>Alpha paragraph has these words.</p>'
+        zeta = '<p>Zeta paragraph is gone for good.</p>'
+        html = self.diff(alpha + zeta, alpha)
+        self.assertIn(
+            '<a class="move" id="move-1-from" href="#move-1">[moved]</a>'
+            '<span class="delete">Zeta paragraph is gone for good.</span>',
+            html
+        )
+        self.assertIn(
+            '<a id="move-1"></a><p><span class="move">Alpha paragraph has '
+            'these words.</span></p><a id="move-1-end"></a>', html
+        )
+
+    def test_side_by_side_keeps_markup(self):
+        moved = '<p>Fish &amp; chips are <b>served</b> &lt;here&gt;.</p>'
+        html = self.diff(moved, moved)
+        left = lib.gen_side_by_side(html).split('<div id="right"')[0]
+        self.assertIn(
+            '<span class="move" id="move-1-from">' + moved + '</span>', left
+        )
+
+    def test_common_runs(self):
+        common = 'as noted by the board'
+        orig = ''.join(
+            '<p>Item {0} {1} was approved.</p>'.format(i, common)
+            for i in range(100)
+        )
+        new = ''.join(
+            '<p>Other {0} {1} was rejected.</p>'.format(i, common)
+            for i in range(100)
+        )
+        moved = '<p>{0} this one paragraph moved almost intact.</p>'
+        html = self.diff(
+            moved.format(common) + orig,
+            new + moved.format(common.replace('board', 'council'))
+        )
+        self.assertEqual(html.count('[moved]'), 1)
+        self.assertIn('<span class="insert">council</span>', html)
+
+    def test_not_a_move(self):
+        html = self.diff(
+            '<p>These words are moving to the end.</p>',
+            '<p>Entirely different words were added here.</p>'
+        )
+        self.assertNotIn('class="move"', html)
+
+    def test_no_moves(self):
+        moved = '<p>These words are moving to the end.</p>'
+        html = lib.HTMLMatcher(
+            DOC.format(moved + self.paras),
+            DOC.format(self.paras + moved),
+            True
+        ).diff_html(detect_moves=False)
+        self.assertNotIn('class="move"', html)
+
+
+class PagedTest(unittest.TestCase):
+
+    def test_unclosed_paragraphs(self):
+        body = '<p>one<p>two<div><p>three<p>four</div><ul><li>a<li>b</ul>'
+        blocks = lib.split_blocks(body)
+        self.assertEqual(''.join(blocks), body)
+        self.assertEqual(blocks, [
+            '<p>one', '<p>two', '<div><p>three<p>four</div>',
+            '<ul><li>a<li>b</ul>',
+        ])
+
+    def test_pages(self):
+        paras = ['<p>Paragraph number {0} here.'.format(i) for i in range(40)]
+        orig = DOC.format(''.join(paras))
+        paras[30] = '<p>Paragraph number thirty changed.'
+        index, pages = lib.gen_paged(
+            lib.diff_strings(orig, DOC.format(''.join(paras)), True),
+            page_size=200
+        )
+        self.assertGreater(len(pages), 2)
+        self.assertIn('page-0001.html', index)
+        self.assertIn('class="insert"', index)
+
+    def test_wrapper_div(self):
+        paras = ['<p>Paragraph number {0} here.</p>'.format(i)
+                 for i in range(200)]
+        orig = DOC.format('<div id="main">{0}</div>'.format(''.join(paras)))
+        paras[100] = '<p>Paragraph number one hundred changed.</p>'
+        new = DOC.format('<div id="main">{0}</div>'.format(''.join(paras)))
+        diffed = lib.diff_strings(orig, new, True)
+        index, pages = lib.gen_paged(diffed, page_size=500)
+        self.assertGreater(len(pages), 10)
+        self.assertEqual(index.count('<div id="page-'), 1)
+        self.assertIn('class="insert"', index)
+        self.assertLess(len(index), len(diffed) / 4)
+        for page in pages:
+            start, body, ending = lib.split_html(page)
+            self.assertTrue(body.startswith('<div id="main"><p>'))
+            self.assertTrue(body.endswith('</p></div>'))
+
+    def test_table_rows(self):
+        rows = ''.join('<tr><td>{0}</td></tr>'.format(i) for i in range(100))
+        body = '<table><tbody>{0}</tbody></table>'.format(rows)
+        blocks = lib.nest_blocks(body, 100)
+        self.assertEqual(len(blocks), 100)
+        self.assertEqual(blocks[0][1], '<tr><td>0</td></tr>')
+        self.assertEqual(
+            [tag for start, tag in blocks[0][0]], ['<table>', '<tbody>']
+        )
+        self.assertEqual(lib.wrap_blocks(blocks), body)
+
+    def test_nested_round_trip(self):
+        body = ('intro<div><p>one</p><div>inner <p>two</p></div></div>'
+                '<div><ul><li>a<li>b</ul></div>')
+        for size in (10, 1000):
+            blocks = lib.nest_blocks(body, size)
+            self.assertEqual(lib.wrap_blocks(blocks), body)
+        # Implied end tags are written out once the blocks are split apart
+        self.assertEqual(
+            lib.wrap_blocks(lib.nest_blocks(body, 1)),
+            body.replace('<li>a<li>b', '<li>a</li><li>b</li>')
+        )
+
+    def test_move_links_across_pages(self):
+        moved = '<p>These words are moving to the end.</p>'
+        paras = ['<p>Paragraph number {0} here.</p>'.format(i)
+                 for i in range(20)]
+        orig = DOC.format(moved + ''.join(paras))
+        new = DOC.format(''.join(paras) + moved)
+        index, pages = lib.gen_paged(
+            lib.diff_strings(orig, new, True), page_size=200
+        )
+        source = [page for page in pages if 'id="move-1-from"' in page]
+        target = [i for i, page in enumerate(pages, 1)
+                  if '<a id="move-1"></a>' in page]
+        self.assertEqual(len(source), 1)
+        self.assertEqual(len(target), 1)
+        self.assertIn(
+            'href="page-{0:04d}.html#move-1"'.format(target[0]), source[0]
+        )
+        self.assertIn('href="#move-1"', index)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'a.snapshot')
+        self.tokens = lib.HTMLMatcher('', '', True).split_html(
+            DOC.format(u'<p>Caf\xe9 au lait, caf\xe9 noir.</p>')
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_round_trip(self):
+        snapshot.write_snapshot(self.tokens, self.path)
+        self.assertTrue(snapshot.is_snapshot(self.path))
+        self.assertEqual(
+            snapshot.read_snapshot(self.path).tokens(), self.tokens
+        )
+
+    def test_wide_ids(self):
+        tokens = ['word{0}'.format(i) for i in range(0x10001)]
+        data = snapshot.Snapshot.from_tokens(tokens).dumps()
+        self.assertEqual(snapshot.Snapshot.loads(data).tokens(), tokens)
+
+    def test_diff(self):
+        new = DOC.format(u'<p>Caf\xe9 au lait, th\xe9 noir.</p>')
+        snapshot.write_snapshot(self.tokens, self.path)
+        new_path = os.path.join(self.tmp, 'b.html')
+        with open(new_path, 'wb') as f:
+            f.write(new.encode('utf-8'))
+        self.assertEqual(
+            lib.diff_files(self.path, new_path, True),
+            lib.diff_strings(''.join(self.tokens), new, True)
+        )
+
+    def test_tokenize(self):
+        html = ''.join(self.tokens)
+        snap = snapshot.Snapshot.from_tokens(self.tokens)
+        for prefix in ('', '<p>Other words first</p> noir'):
+            matcher = lib.HTMLMatcher(prefix, '', True)
+            expected = matcher.tokenize(html)
+            tokens = matcher.tokenize(snap)
+            self.assertEqual(tokens.ids, expected.ids)
+            self.assertEqual(tokens.source, expected.source)
+            self.assertEqual(list(tokens.starts), list(expected.starts))
+            self.assertEqual(list(tokens.ends), list(expected.ends))
+            self.assertEqual(len(matcher.kinds), len(matcher.vocab))
+            for token, token_id in matcher.vocab.items():
+                self.assertEqual(
+                    matcher.kinds[token_id], snapshot.token_kind(token)
+                )
+
+    def test_summary(self):
+        new = DOC.format(u'<p>Caf\xe9 au lait, th\xe9 noir.</p><hr/>')
+        self.assertEqual(
+            lib.diff_summary(snapshot.Snapshot.from_tokens(self.tokens), new),
+            lib.diff_summary(''.join(self.tokens), new)
+        )
+
+    def test_truncated(self):
+        data = snapshot.Snapshot.from_tokens(self.tokens).dumps()
+        for length in (len(data) - 1, len(data) - 4, 20, 10):
+            with open(self.path, 'wb') as f:
+                f.write(data[:length])
+            self.assertRaises(ValueError, snapshot.read_snapshot, self.path)
+
+    def test_bad_ids(self):
+        data = bytearray(snapshot.Snapshot.from_tokens(self.tokens).dumps())
+        data[-2:] = b'\xff\xff'
+        with open(self.path, 'wb') as f:
+            f.write(bytes(data))
+        self.assertRaises(ValueError, snapshot.read_snapshot, self.path)
+
+
+class WatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.orig = os.path.join(self.tmp, 'a.html')
+        self.new = os.path.join(self.tmp, 'b.html')
+        self.out = os.path.join(self.tmp, 'out.html')
+        self.write(self.orig, '<p>One two three.</p>')
+        self.write(self.new, '<p>One two four.</p>')
+        self.watcher = DiffWatcher(self.orig, self.new, self.out, True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, path, body):
+        with open(path, 'w') as f:
+            f.write(DOC.format(body))
+
+    def output(self):
+        with open(self.out) as f:
+            return f.read()
+
+    def expected(self):
+        return lib.diff_files(self.orig, self.new, True)
+
+    def test_poll(self):
+        self.assertTrue(self.watcher.poll())
+        self.assertEqual(self.output(), self.expected())
+        self.assertFalse(self.watcher.poll())
+        self.write(self.orig, '<p>One two five.</p>')
+        self.assertTrue(self.watcher.poll())
+        self.assertEqual(self.output(), self.expected())
+
+    def test_same_size_same_mtime(self):
+        self.watcher.poll()
+        stat = os.stat(self.new)
+        self.write(self.new, '<p>One two fivE.</p>')
+        os.utime(self.new, (stat.st_atime, stat.st_mtime))
+        self.assertTrue(self.watcher.poll())
+        self.assertEqual(self.output(), self.expected())
+
+    def test_missing_file_during_save(self):
+        self.watcher.poll()
+        self.write(self.orig, '<p>Zero two three.</p>')
+        moved = self.new + '.tmp'
+        os.rename(self.new, moved)
+        self.assertRaises(EnvironmentError, self.watcher.poll)
+        os.rename(moved, self.new)
+        self.assertTrue(self.watcher.poll())
+        self.assertEqual(self.output(), self.expected())
+
+    def test_snapshot_input(self):
+        self.watcher.poll()
+        with open(self.orig, 'rb') as f:
+            tokens = lib.HTMLMatcher('', '', True).split_html(
+                f.read().decode('utf-8')
+            )
+        snapshot.write_snapshot(tokens, self.orig)
+        self.write(self.new, '<p>One two six.</p>')
+        self.assertTrue(self.watcher.poll())
+        self.assertEqual(self.output(), self.expected())
+        self.assertNotIn('HDSNAP', self.output())
+
+    def test_vocab_is_compacted(self):
+        self.watcher.poll()
+        for i in range(20):
+            self.write(self.new, '<p>' + ' '.join(
+                'word{0}x{1}'.format(i, j) for j in range(50)
+            ) + '</p>')
+            self.watcher.poll()
+        matcher = self.watcher.matcher
+        live = len(set(matcher.a).union(matcher.b))
+        self.assertLessEqual(len(matcher.vocab), 2 * live)
+        self.assertEqual(self.output(), self.expected())
+
+
 if __name__ == '__main__':
     unittest.main()